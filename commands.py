@@ -2,27 +2,27 @@
 Telegram bot command handlers
 """
 
+import asyncio
 import logging
+import time
 from datetime import datetime
+from typing import Awaitable, Callable, Final
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
 from signals.signal_generator import SignalGenerator
 from storage.signal_storage import SignalStorage
-from utils.logger import setup_logger
 
-logger = setup_logger()
+logger = logging.getLogger(__name__)
 
-class BotCommands:
-    """Handles all bot commands"""
-    
-    def __init__(self, signal_generator: SignalGenerator, storage: SignalStorage):
-        self.signal_generator = signal_generator
-        self.storage = storage
-        
-    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /start command"""
-        welcome_message = """
+# Symbols accepted by /analyze
+_SUPPORTED: Final[frozenset[str]] = frozenset({'XAUUSD', 'EURUSD', 'GBPUSD'})
+
+# Seconds an /analyze result is reused for the same symbol
+ANALYSIS_CACHE_TTL = 30
+
+# Static replies, built once at import instead of on every command
+_WELCOME_MSG: Final[str] = """
 🤖 <b>Welcome to XAUUSD & Forex Trading Signal Bot</b>
 
 This bot provides automated trading signals for:
@@ -46,11 +46,8 @@ This bot provides automated trading signals for:
 
 <i>Use /help for detailed command information</i>
 """
-        await update.message.reply_text(welcome_message, parse_mode='HTML')
-        
-    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /help command"""
-        help_message = """
+
+_HELP_MSG: Final[str] = """
 📋 <b>Bot Commands Help</b>
 
 <b>Basic Commands:</b>
@@ -81,19 +78,169 @@ This bot provides automated trading signals for:
 
 <i>For technical support or questions, contact the administrator.</i>
 """
-        await update.message.reply_text(help_message, parse_mode='HTML')
+
+_SETTINGS_MSG: Final[str] = """
+⚙️ <b>Bot Settings</b>
+
+<b>Current Configuration:</b>
+• RSI Period: 14
+• RSI Overbought: 70
+• RSI Oversold: 30
+• Fibonacci Level: 0.618
+• Default Risk %: 2%
+• Min Risk/Reward: 1:2
+
+<b>Active Timeframes:</b>
+• 1 Hour ✅
+• 4 Hour ✅
+• Daily ✅
+
+<i>Click buttons below to modify settings</i>
+"""
+
+_SUBSCRIBED_MSG: Final[str] = """
+✅ <b>Successfully subscribed to trading signals!</b>
+
+You will now receive:
+🔔 Real-time signal notifications
+📊 Market analysis updates
+⚡ Entry/Exit recommendations
+
+<i>Use /unsubscribe to stop receiving notifications</i>
+"""
+
+_UNSUBSCRIBED_MSG: Final[str] = """
+❌ <b>Successfully unsubscribed from trading signals</b>
+
+You will no longer receive:
+🔕 Signal notifications
+📊 Market updates
+
+<i>Use /subscribe to resume notifications</i>
+"""
+
+_RSI_MSG: Final[str] = """
+📊 <b>RSI Settings</b>
+
+<b>Current Settings:</b>
+• Period: 14
+• Overbought Level: 70
+• Oversold Level: 30
+
+<b>Recommendations:</b>
+• Period: 14 (standard)
+• Overbought: 70-80
+• Oversold: 20-30
+
+<i>These settings are optimized for forex trading</i>
+"""
+
+_FIB_MSG: Final[str] = """
+📐 <b>Fibonacci Settings</b>
+
+<b>Current Settings:</b>
+• Primary Level: 0.618 (Golden Ratio)
+• Secondary Levels: 0.382, 0.5, 0.786
+
+<b>Usage:</b>
+• 0.618 level is the primary trigger
+• Price action at this level combined with RSI generates signals
+
+<i>0.618 is statistically the most reliable retracement level</i>
+"""
+
+_RISK_MSG: Final[str] = """
+⚠️ <b>Risk Management Settings</b>
+
+<b>Current Settings:</b>
+• Default Risk per Trade: 2%
+• Minimum Risk/Reward: 1:2
+• Maximum Position Size: 5%
+
+<b>Safety Features:</b>
+• Automatic position sizing
+• Stop loss always calculated
+• Risk/reward validation
+
+<i>These settings help protect your capital</i>
+"""
+
+_TF_MSG: Final[str] = """
+⏰ <b>Timeframe Settings</b>
+
+<b>Active Timeframes:</b>
+• 1 Hour ✅ (Short-term scalping)
+• 4 Hour ✅ (Medium-term swings)
+• Daily ✅ (Long-term trends)
+
+<b>Analysis Method:</b>
+• Multiple timeframe confirmation
+• Higher timeframe bias
+• Lower timeframe entry
+
+<i>All timeframes are analyzed for signal validation</i>
+"""
+
+_EMOJI: Final[dict[str, str]] = {'BUY': '🟢', 'SELL': '🔴'}
+
+# One /signals entry, filled per stored signal
+_SIGNAL_ROW_TMPL: Final[str] = """
+{emoji} <b>{symbol}</b> - {signal}
+Entry: {entry_price:.5f}
+TP: {take_profit:.5f} | SL: {stop_loss:.5f}
+Time: {timestamp}
+---
+"""
+
+# Inline keyboard callback_data -> reply
+_CALLBACK_RESPONSES: Final[dict[str, str]] = {
+    'settings_rsi': _RSI_MSG,
+    'settings_fib': _FIB_MSG,
+    'settings_risk': _RISK_MSG,
+    'settings_timeframes': _TF_MSG,
+}
+
+class BotCommands:
+    """Handles all bot commands"""
+    
+    __slots__ = ('signal_generator', 'storage', 'add_subscriber', 'remove_subscriber', '_analysis_cache')
+    
+    def __init__(self, signal_generator: SignalGenerator, storage: SignalStorage,
+                 add_subscriber: Callable[[int], Awaitable[None]], remove_subscriber: Callable[[int], Awaitable[None]]):
+        self.signal_generator = signal_generator
+        # SignalStorage methods are synchronous disk I/O; call them through
+        # asyncio.to_thread so they don't stall the event loop
+        self.storage = storage
+        # Subscriber bookkeeping lives on TradingSignalBot (writes through to storage)
+        self.add_subscriber = add_subscriber
+        self.remove_subscriber = remove_subscriber
+        # (event loop id, symbol) -> (created at monotonic, analysis time, analysis task)
+        self._analysis_cache: dict[tuple[int, str], tuple[float, datetime, asyncio.Task]] = {}
+        
+    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /start command"""
+        await update.message.reply_text(_WELCOME_MSG)
+        
+    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /help command"""
+        await update.message.reply_text(_HELP_MSG)
         
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /status command"""
         try:
             # Check market status and bot health
-            market_status = await self.signal_generator.get_market_status()
+            market_status, signals_today, total_signals = await asyncio.gather(
+                self.signal_generator.get_market_status(),
+                asyncio.to_thread(self.storage.get_signals_count_today),
+                asyncio.to_thread(self.storage.get_total_signals)
+            )
+            now = datetime.now()
             
             status_message = f"""
 🟢 <b>Bot Status: ACTIVE</b>
 
 📊 <b>Market Status:</b>
-• Current Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+• Current Time: {now.strftime('%Y-%m-%d %H:%M:%S')}
 • Market State: {market_status.get('state', 'Unknown')}
 • Last Update: {market_status.get('last_update', 'N/A')}
 
@@ -108,80 +255,54 @@ This bot provides automated trading signals for:
 • Signal Generation: ✅ Working
 
 📊 <b>Recent Activity:</b>
-• Signals Today: {self.storage.get_signals_count_today()}
-• Total Signals: {self.storage.get_total_signals()}
+• Signals Today: {signals_today}
+• Total Signals: {total_signals}
 
-<i>Last system check: {datetime.now().strftime('%H:%M:%S')}</i>
+<i>Last system check: {now.strftime('%H:%M:%S')}</i>
 """
-            await update.message.reply_text(status_message, parse_mode='HTML')
+            await update.message.reply_text(status_message)
             
-        except Exception as e:
-            logger.error(f"Error in status command: {e}")
+        except Exception:
+            logger.exception("Error in status command")
             await update.message.reply_text("❌ Error checking status. Please try again later.")
             
     async def signals_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /signals command"""
         try:
-            recent_signals = self.storage.get_recent_signals(limit=10)
+            recent_signals = await asyncio.to_thread(self.storage.get_recent_signals, limit=10)
             
             if not recent_signals:
                 await update.message.reply_text("📭 No recent signals found.")
                 return
                 
-            message = "📊 <b>Recent Trading Signals</b>\n\n"
-            
-            for signal in recent_signals:
-                signal_emoji = "🟢" if signal['signal'] == 'BUY' else "🔴"
-                message += f"""
-{signal_emoji} <b>{signal['symbol']}</b> - {signal['signal']}
-Entry: {signal['entry_price']:.5f}
-TP: {signal['take_profit']:.5f} | SL: {signal['stop_loss']:.5f}
-Time: {signal['timestamp']}
----
-"""
+            parts = ["📊 <b>Recent Trading Signals</b>\n\n"]
+            parts.extend(
+                _SIGNAL_ROW_TMPL.format_map({**signal, 'emoji': _EMOJI.get(signal['signal'], '🔴')})
+                for signal in recent_signals
+            )
+            message = ''.join(parts)
             
-            await update.message.reply_text(message, parse_mode='HTML')
+            await update.message.reply_text(message)
             
-        except Exception as e:
-            logger.error(f"Error in signals command: {e}")
+        except Exception:
+            logger.exception("Error in signals command")
             await update.message.reply_text("❌ Error retrieving signals. Please try again later.")
             
     async def subscribe_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /subscribe command"""
         chat_id = update.message.chat_id
         
-        # Add to subscribers via callback
-        if hasattr(context, 'bot_data') and 'add_subscriber' in context.bot_data:
-            context.bot_data['add_subscriber'](chat_id)
+        await self.add_subscriber(chat_id)
         
-        await update.message.reply_text("""
-✅ <b>Successfully subscribed to trading signals!</b>
-
-You will now receive:
-🔔 Real-time signal notifications
-📊 Market analysis updates
-⚡ Entry/Exit recommendations
-
-<i>Use /unsubscribe to stop receiving notifications</i>
-""", parse_mode='HTML')
+        await update.message.reply_text(_SUBSCRIBED_MSG)
         
     async def unsubscribe_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /unsubscribe command"""
         chat_id = update.message.chat_id
         
-        # Remove from subscribers via callback
-        if hasattr(context, 'bot_data') and 'remove_subscriber' in context.bot_data:
-            context.bot_data['remove_subscriber'](chat_id)
+        await self.remove_subscriber(chat_id)
         
-        await update.message.reply_text("""
-❌ <b>Successfully unsubscribed from trading signals</b>
-
-You will no longer receive:
-🔕 Signal notifications
-📊 Market updates
-
-<i>Use /subscribe to resume notifications</i>
-""", parse_mode='HTML')
+        await update.message.reply_text(_UNSUBSCRIBED_MSG)
         
     async def analyze_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /analyze command"""
@@ -192,7 +313,7 @@ You will no longer receive:
                 
             symbol = context.args[0].upper()
             
-            if symbol not in ['XAUUSD', 'EURUSD', 'GBPUSD']:
+            if symbol not in _SUPPORTED:
                 await update.message.reply_text("❌ Unsupported symbol. Use: XAUUSD, EURUSD, or GBPUSD")
                 return
                 
@@ -200,7 +321,7 @@ You will no longer receive:
             await update.message.reply_text("🔍 Analyzing market data...")
             
             # Perform analysis
-            analysis = await self.signal_generator.analyze_symbol(symbol)
+            analysis, analyzed_at = await self._analyze_symbol_cached(symbol)
             
             if not analysis:
                 await update.message.reply_text("❌ Unable to analyze symbol. Please try again later.")
@@ -228,15 +349,44 @@ You will no longer receive:
 <b>Recommendation:</b>
 {analysis['recommendation']}
 
-<i>Analysis time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</i>
+<i>Analysis time: {analyzed_at.strftime('%Y-%m-%d %H:%M:%S')}</i>
 """
             
-            await update.message.reply_text(message, parse_mode='HTML')
+            await update.message.reply_text(message)
             
-        except Exception as e:
-            logger.error(f"Error in analyze command: {e}")
+        except Exception:
+            logger.exception("Error in analyze command")
             await update.message.reply_text("❌ Error performing analysis. Please try again later.")
             
+    async def _analyze_symbol_cached(self, symbol: str):
+        """Analyze symbol via a shared short-lived cache, returning (analysis, time it was made)"""
+        # Tasks are bound to the loop that created them, so key the cache per loop
+        key = (id(asyncio.get_running_loop()), symbol)
+        now = time.monotonic()
+        
+        cached = self._analysis_cache.get(key)
+        if cached:
+            created, analyzed_at, task = cached
+            if not task.done():
+                return await asyncio.shield(task), analyzed_at
+            if now - created < ANALYSIS_CACHE_TTL and not task.cancelled() and task.exception() is None:
+                return task.result(), analyzed_at
+                
+        analyzed_at = datetime.now()
+        task = asyncio.create_task(self.signal_generator.analyze_symbol(symbol))
+        self._analysis_cache[key] = (now, analyzed_at, task)
+        
+        try:
+            analysis = await asyncio.shield(task)
+        except Exception:
+            self._analysis_cache.pop(key, None)
+            raise
+            
+        # Don't hold on to failed analyses
+        if not analysis:
+            self._analysis_cache.pop(key, None)
+        return analysis, analyzed_at
+        
     async def settings_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /settings command"""
         keyboard = [
@@ -247,28 +397,8 @@ You will no longer receive:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        settings_message = """
-⚙️ <b>Bot Settings</b>
-
-<b>Current Configuration:</b>
-• RSI Period: 14
-• RSI Overbought: 70
-• RSI Oversold: 30
-• Fibonacci Level: 0.618
-• Default Risk %: 2%
-• Min Risk/Reward: 1:2
-
-<b>Active Timeframes:</b>
-• 1 Hour ✅
-• 4 Hour ✅
-• Daily ✅
-
-<i>Click buttons below to modify settings</i>
-"""
-        
         await update.message.reply_text(
-            settings_message, 
-            parse_mode='HTML',
+            _SETTINGS_MSG,
             reply_markup=reply_markup
         )
         
@@ -277,72 +407,8 @@ You will no longer receive:
         query = update.callback_query
         await query.answer()
         
-        if query.data.startswith('settings_'):
-            setting_type = query.data.split('_')[1]
+        message = _CALLBACK_RESPONSES.get(query.data)
+        if message is None:
+            message = "❌ Unknown setting type"
             
-            if setting_type == 'rsi':
-                message = """
-📊 <b>RSI Settings</b>
-
-<b>Current Settings:</b>
-• Period: 14
-• Overbought Level: 70
-• Oversold Level: 30
-
-<b>Recommendations:</b>
-• Period: 14 (standard)
-• Overbought: 70-80
-• Oversold: 20-30
-
-<i>These settings are optimized for forex trading</i>
-"""
-            elif setting_type == 'fib':
-                message = """
-📐 <b>Fibonacci Settings</b>
-
-<b>Current Settings:</b>
-• Primary Level: 0.618 (Golden Ratio)
-• Secondary Levels: 0.382, 0.5, 0.786
-
-<b>Usage:</b>
-• 0.618 level is the primary trigger
-• Price action at this level combined with RSI generates signals
-
-<i>0.618 is statistically the most reliable retracement level</i>
-"""
-            elif setting_type == 'risk':
-                message = """
-⚠️ <b>Risk Management Settings</b>
-
-<b>Current Settings:</b>
-• Default Risk per Trade: 2%
-• Minimum Risk/Reward: 1:2
-• Maximum Position Size: 5%
-
-<b>Safety Features:</b>
-• Automatic position sizing
-• Stop loss always calculated
-• Risk/reward validation
-
-<i>These settings help protect your capital</i>
-"""
-            elif setting_type == 'timeframes':
-                message = """
-⏰ <b>Timeframe Settings</b>
-
-<b>Active Timeframes:</b>
-• 1 Hour ✅ (Short-term scalping)
-• 4 Hour ✅ (Medium-term swings)
-• Daily ✅ (Long-term trends)
-
-<b>Analysis Method:</b>
-• Multiple timeframe confirmation
-• Higher timeframe bias
-• Lower timeframe entry
-
-<i>All timeframes are analyzed for signal validation</i>
-"""
-            else:
-                message = "❌ Unknown setting type"
-                
-            await query.edit_message_text(text=message, parse_mode='HTML')
+        await query.edit_message_text(text=message)
@@ -22,16 +22,47 @@ from scheduler.market_scanner import MarketScanner
 from utils.logger import setup_logger
 from utils.config import Config
 
-# Setup logging
-logger = setup_logger()
+# Loggers of this application's own modules (logging.getLogger(__name__))
+APP_LOGGERS = ('__main__', 'bot')
+
+def configure_logging():
+    """Send this application's module loggers through the handlers set up by setup_logger()"""
+    app_logger = setup_logger()
+    
+    # Only our own loggers; third-party libraries and the root logger are left alone
+    for name in APP_LOGGERS:
+        module_logger = logging.getLogger(name)
+        for handler in app_logger.handlers:
+            if handler not in module_logger.handlers:
+                module_logger.addHandler(handler)
+        module_logger.setLevel(app_logger.getEffectiveLevel())
+        # Already handled here, don't log records a second time via root
+        module_logger.propagate = False
+        
+    # httpx logs every request URL at INFO, and the bot API URL contains the token
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Setup logging once for the whole application
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Global variables for graceful shutdown
 bot_instance = None
 scanner_instance = None
 
+# Set once shutdown starts so cleanup only runs once
+stop_event = asyncio.Event()
+
+# Running shutdown tasks, referenced so they aren't garbage-collected mid-run
+shutdown_tasks = set()
+
 async def shutdown_handler(signum, frame):
     """Handle shutdown signals gracefully"""
-    logger.info(f"Received signal {signum}, shutting down...")
+    if stop_event.is_set():
+        return
+    stop_event.set()
+    
+    logger.info("Received signal %s, shutting down...", signum)
     
     if scanner_instance:
         await scanner_instance.stop_scanning()
@@ -41,6 +72,12 @@ async def shutdown_handler(signum, frame):
     
     logger.info("Shutdown complete")
 
+def schedule_shutdown(signum):
+    """Start shutdown_handler from a loop signal handler"""
+    task = asyncio.create_task(shutdown_handler(signum, None))
+    shutdown_tasks.add(task)
+    task.add_done_callback(shutdown_tasks.discard)
+
 async def main():
     """Main application entry point"""
     global bot_instance, scanner_instance
@@ -70,31 +107,38 @@ async def main():
         # Set up callback for scanner to send signals to bot
         scanner_instance.set_signal_callback(bot_instance.send_signal_to_subscribers)
         
-        # Start market scanning in background
-        scanner_task = asyncio.create_task(scanner_instance.start_scanning())
+        # Stop the bot and scanner cleanly on SIGINT/SIGTERM instead of tearing down the loop
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, schedule_shutdown, sig)
+            except NotImplementedError:
+                # Not supported by the Windows event loop, KeyboardInterrupt still applies
+                pass
         
         # Start bot
         logger.info("Starting Telegram Trading Signal Bot...")
         
-        # Run both tasks concurrently
+        # Run the bot and the market scanner side by side on this event loop
         await asyncio.gather(
             bot_instance.start(),
-            scanner_task,
+            scanner_instance.start_scanning(),
             return_exceptions=True
         )
         
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
-    except Exception as e:
-        logger.error(f"Fatal error: {e}")
+    except Exception:
         # Don't re-raise in production
-        logger.exception("Full error traceback:")
+        logger.exception("Fatal error")
     finally:
-        # Ensure cleanup
-        if scanner_instance:
-            await scanner_instance.stop_scanning()
-        if bot_instance:
-            await bot_instance.stop()
+        # Ensure cleanup if no signal handler did it already
+        if not stop_event.is_set():
+            stop_event.set()
+            if scanner_instance:
+                await scanner_instance.stop_scanning()
+            if bot_instance:
+                await bot_instance.stop()
 
 def run_bot():
     """Run the bot with proper event loop handling"""
@@ -108,9 +152,8 @@ def run_bot():
             
     except KeyboardInterrupt:
         logger.info("Application interrupted by user")
-    except Exception as e:
-        logger.error(f"Failed to start bot: {e}")
-        logger.exception("Full error traceback:")
+    except Exception:
+        logger.exception("Failed to start bot")
 
 if __name__ == "__main__":
     run_bot()
@@ -4,38 +4,147 @@ Telegram bot implementation for trading signals
 
 import asyncio
 import logging
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+from aiolimiter import AsyncLimiter
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, CallbackQueryHandler, Defaults, TypeHandler
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.request import HTTPXRequest
 from telegram.ext import ContextTypes
 
 from bot.commands import BotCommands
 from signals.signal_generator import SignalGenerator
 from storage.signal_storage import SignalStorage
-from utils.logger import setup_logger
 
-logger = setup_logger()
+logger = logging.getLogger(__name__)
+
+_SIGNAL_LABEL = {'BUY': '🟢 BUY', 'SELL': '🔴 SELL'}
+
+# Broadcast message, filled per signal
+_SIGNAL_MSG_TMPL = """
+🚨 <b>TRADING SIGNAL</b> 🚨
+
+<b>Pair:</b> {symbol}
+<b>Signal:</b> {signal_type}
+<b>Timeframe:</b> {timeframe}
+<b>Entry Price:</b> {entry_price:.5f}
+
+📊 <b>Technical Analysis:</b>
+• RSI: {rsi:.2f}
+• Fibonacci Level: {fib_level:.3f}
+• Confidence: {confidence:.1f}%
+
+🎯 <b>Targets:</b>
+• Take Profit: {take_profit:.5f}
+• Stop Loss: {stop_loss:.5f}
+
+⚠️ <b>Risk Management:</b>
+• Risk/Reward: 1:{risk_reward:.2f}
+• Suggested Position Size: {position_size:.2f}%
+
+<i>Generated at: {timestamp}</i>
+"""
+
+# Seconds to collect signals that fire together into one broadcast
+SIGNAL_BATCH_DELAY = 0.5
+
+# Seconds to remember an update id for duplicate suppression
+DEDUP_TTL = 60
+
+# SignalStorage API that persists subscribers across restarts:
+#   get_subscribers() -> list[int], add_subscriber(chat_id), remove_subscriber(chat_id)
+# A storage class provides all of them or none (subscribers are then kept in memory only).
+_SUBSCRIBER_STORAGE_METHODS = ('get_subscribers', 'add_subscriber', 'remove_subscriber')
+
+def _is_unreachable(error: Exception) -> bool:
+    """Whether a send error means the chat is gone for good"""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and 'chat not found' in error.message.lower()
 
 class TradingSignalBot:
     """Main Telegram bot class for trading signals"""
     
+    __slots__ = (
+        'token', 'alpha_vantage_key', 'application', 'signal_generator', 'storage',
+        'commands', 'subscribers', '_global_limiter', '_chat_limiters', '_seen', '_stopped',
+        '_pending_signals', '_flush_task', '_flush_tasks', '_persist_subscribers', '_subscriber_lock'
+    )
+    
     def __init__(self, token: str, alpha_vantage_key: str):
         self.token = token
         self.alpha_vantage_key = alpha_vantage_key
-        self.application = Application.builder().token(token).build()
+        self.application = (
+            Application.builder()
+            .token(token)
+            # HTML for every message, and handlers don't block the update queue
+            .defaults(Defaults(parse_mode=ParseMode.HTML, block=False))
+            # Process updates in their own tasks so a slow /analyze doesn't hold up other users
+            .concurrent_updates(True)
+            # One pooled HTTP/2 client for all bot API calls, so broadcasts reuse connections
+            .request(HTTPXRequest(
+                connection_pool_size=64,
+                http_version='2',
+                connect_timeout=5,
+                read_timeout=20
+            ))
+            .get_updates_request(HTTPXRequest(connection_pool_size=8))
+            .build()
+        )
         self.signal_generator = SignalGenerator(alpha_vantage_key)
         self.storage = SignalStorage()
-        self.commands = BotCommands(self.signal_generator, self.storage)
+        self.commands = BotCommands(
+            self.signal_generator,
+            self.storage,
+            add_subscriber=self.add_subscriber,
+            remove_subscriber=self.remove_subscriber
+        )
+        # Subscribers persist in storage; loaded in start(), kept in memory for broadcasts
         self.subscribers = set()
+        provided = [
+            name for name in _SUBSCRIBER_STORAGE_METHODS
+            if callable(getattr(self.storage, name, None))
+        ]
+        if provided and len(provided) != len(_SUBSCRIBER_STORAGE_METHODS):
+            raise TypeError(
+                f"SignalStorage implements only {', '.join(provided)} of the subscriber API "
+                f"({', '.join(_SUBSCRIBER_STORAGE_METHODS)})"
+            )
+        self._persist_subscribers = bool(provided)
+        if not self._persist_subscribers:
+            logger.error("SignalStorage has no subscriber API, subscribers will be lost on restart")
+        # Serializes subscriber writes so they reach storage in the order they were made
+        self._subscriber_lock = asyncio.Lock()
+        
+        # Pace outbound sends below Telegram's limits (~30 msg/s overall, 1 msg/s per chat)
+        self._global_limiter = AsyncLimiter(25, 1)
+        self._chat_limiters: dict[int, AsyncLimiter] = {}
+        
+        # Recently seen update ids, oldest first, used to drop redelivered updates
+        self._seen: OrderedDict[int, float] = OrderedDict()
+        
+        # Signals waiting to go out in the next batched broadcast. _flush_task is the
+        # flush still collecting signals; _flush_tasks holds every flush until its
+        # broadcast has finished.
+        self._pending_signals: list[dict] = []
+        self._flush_task: asyncio.Task | None = None
+        self._flush_tasks: set[asyncio.Task] = set()
+        
+        # Set by stop() to release start()
+        self._stopped = asyncio.Event()
         
         # Setup handlers
         self._setup_handlers()
         
-        # Set up bot data for commands
-        self.application.bot_data['add_subscriber'] = self.add_subscriber
-        self.application.bot_data['remove_subscriber'] = self.remove_subscriber
-        
     def _setup_handlers(self):
         """Setup command and callback handlers"""
+        # Drop duplicate updates before any other handler runs
+        self.application.add_handler(TypeHandler(Update, self._dedup_filter, block=True), group=-1)
+        
         # Command handlers
         self.application.add_handler(CommandHandler("start", self.commands.start_command))
         self.application.add_handler(CommandHandler("help", self.commands.help_command))
@@ -52,85 +161,189 @@ class TradingSignalBot:
         # Error handler
         self.application.add_error_handler(self.error_handler)
         
+    async def _dedup_filter(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Stop processing of updates already handled within the last minute"""
+        now = time.monotonic()
+        update_id = update.update_id
+        
+        if update_id in self._seen:
+            logger.info("Skipping duplicate update %s", update_id)
+            raise ApplicationHandlerStop
+        
+        self._seen[update_id] = now
+        while self._seen and now - next(iter(self._seen.values())) > DEDUP_TTL:
+            self._seen.popitem(last=False)
+            
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle errors"""
-        logger.error(f"Update {update} caused error {context.error}")
+        logger.error("Update %s caused error", update, exc_info=context.error)
         
     async def start(self):
         """Start the bot"""
         logger.info("Starting Telegram bot...")
         try:
-            # Use the simpler run_polling method which handles the event loop internally
-            await self.application.run_polling(drop_pending_updates=True)
-        except Exception as e:
-            logger.error(f"Error starting bot: {e}")
+            if self._persist_subscribers:
+                self.subscribers.update(await asyncio.to_thread(self.storage.get_subscribers))
+                logger.info("Loaded %d subscribers", len(self.subscribers))
+                
+            await self.application.initialize()
+            
+            # Webhooks in production (set WEBHOOK_URL), long polling for local development
+            webhook_url = os.getenv("WEBHOOK_URL")
+            if webhook_url:
+                logger.info("Using webhook at %s", webhook_url)
+                await self.application.updater.start_webhook(
+                    listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+                    port=int(os.getenv("PORT", 8443)),
+                    url_path=urlparse(webhook_url).path.lstrip('/'),
+                    webhook_url=webhook_url,
+                    secret_token=os.getenv("WEBHOOK_SECRET"),
+                    drop_pending_updates=True
+                )
+            else:
+                logger.info("Using long polling")
+                await self.application.updater.start_polling(drop_pending_updates=True)
+                
+            await self.application.start()
+            
+            # Keep running until stop() is called
+            await self._stopped.wait()
+        except Exception:
+            logger.exception("Error starting bot")
             raise
         
     async def stop(self):
         """Stop the bot"""
         logger.info("Stopping Telegram bot...")
         try:
+            # Deliver queued signals and finish broadcasts already in flight
+            while self._flush_tasks:
+                await asyncio.gather(*self._flush_tasks)
+                
             # Stop the application gracefully
-            await self.application.stop()
-        except Exception as e:
-            logger.error(f"Error stopping bot: {e}")
+            if self.application.updater and self.application.updater.running:
+                await self.application.updater.stop()
+            if self.application.running:
+                await self.application.stop()
+            await self.application.shutdown()
+        except Exception:
+            logger.exception("Error stopping bot")
             # Don't raise here to allow graceful shutdown
+        finally:
+            self._stopped.set()
         
     async def send_signal_to_subscribers(self, signal_data: dict):
-        """Send trading signal to all subscribers"""
+        """Queue trading signal for all subscribers, batching signals that fire together"""
+        self._pending_signals.append(signal_data)
+        
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+            self._flush_tasks.add(self._flush_task)
+            self._flush_task.add_done_callback(self._flush_tasks.discard)
+            
+    async def _flush(self):
+        """Wait for the batch window, then broadcast all queued signals"""
+        await asyncio.sleep(SIGNAL_BATCH_DELAY)
+        signals, self._pending_signals = self._pending_signals, []
+        # Later signals start a new batch; this one stays in _flush_tasks until sent
+        self._flush_task = None
+        
         if not self.subscribers:
-            logger.info("No subscribers to send signal to")
+            logger.info("No subscribers to send %d signal(s) to", len(signals))
             return
             
-        message = self._format_signal_message(signal_data)
-        
-        for chat_id in self.subscribers.copy():
+        # Combine signals into as few messages as Telegram's length limit allows
+        messages = []
+        parts, length = [], 0
+        for signal_data in signals:
             try:
-                await self.application.bot.send_message(
-                    chat_id=chat_id,
-                    text=message,
-                    parse_mode='HTML'
-                )
-            except Exception as e:
-                logger.error(f"Failed to send signal to {chat_id}: {e}")
-                # Remove invalid chat_id
-                self.subscribers.discard(chat_id)
+                text = self._format_signal_message(signal_data)
+            except Exception:
+                # Skip only the malformed signal, the rest of the batch still goes out
+                logger.exception("Error formatting signal %s", signal_data)
+                continue
+            if parts and length + len(text) > MessageLimit.MAX_TEXT_LENGTH:
+                messages.append(''.join(parts))
+                parts, length = [], 0
+            parts.append(text)
+            length += len(text)
+        if parts:
+            messages.append(''.join(parts))
+            
+        try:
+            for message in messages:
+                await self._broadcast(message)
+        except Exception:
+            logger.exception("Error broadcasting signals")
+            
+    async def _broadcast(self, message: str):
+        """Send message to all subscribers"""
+        snapshot = tuple(self.subscribers)
+        
+        # Send to all subscribers concurrently instead of one round-trip at a time
+        tasks = [self._send_message(chat_id, message) for chat_id in snapshot]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        dead = []
+        for chat_id, result in zip(snapshot, results):
+            if isinstance(result, Exception):
+                logger.error("Failed to send signal to %s: %s", chat_id, result)
+                # Only chats that blocked the bot or no longer exist; errors about
+                # the message itself would otherwise hit every subscriber
+                if _is_unreachable(result):
+                    dead.append(chat_id)
+                    
+        if dead:
+            self.subscribers.difference_update(dead)
+            for chat_id in dead:
+                self._chat_limiters.pop(chat_id, None)
+            if self._persist_subscribers:
+                async with self._subscriber_lock:
+                    await asyncio.to_thread(self._forget_subscribers, dead)
+                    
+    def _forget_subscribers(self, chat_ids: list):
+        """Delete subscribers from storage in one worker thread call (blocking)"""
+        for chat_id in chat_ids:
+            self.storage.remove_subscriber(chat_id)
+            
+    async def _send_message(self, chat_id: int, text: str):
+        """Send a message, retrying once if Telegram's flood control kicks in anyway"""
+        try:
+            return await self._send_limited(chat_id, text)
+        except RetryAfter as e:
+            logger.warning("Rate limited sending to %s, retrying in %ss", chat_id, e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            return await self._send_limited(chat_id, text)
+            
+    async def _send_limited(self, chat_id: int, text: str):
+        """Send a message while respecting the global and per-chat rate limits"""
+        chat_limiter = self._chat_limiters.get(chat_id)
+        if chat_limiter is None:
+            chat_limiter = self._chat_limiters[chat_id] = AsyncLimiter(1, 1)
+            
+        async with chat_limiter:
+            async with self._global_limiter:
+                return await self.application.bot.send_message(chat_id=chat_id, text=text)
                 
     def _format_signal_message(self, signal_data: dict) -> str:
         """Format signal data into readable message"""
-        signal_type = "🟢 BUY" if signal_data['signal'] == 'BUY' else "🔴 SELL"
+        return _SIGNAL_MSG_TMPL.format_map({**signal_data, 'signal_type': _SIGNAL_LABEL.get(signal_data['signal'], '🔴 SELL')})
         
-        message = f"""
-🚨 <b>TRADING SIGNAL</b> 🚨
-
-<b>Pair:</b> {signal_data['symbol']}
-<b>Signal:</b> {signal_type}
-<b>Timeframe:</b> {signal_data['timeframe']}
-<b>Entry Price:</b> {signal_data['entry_price']:.5f}
-
-📊 <b>Technical Analysis:</b>
-• RSI: {signal_data['rsi']:.2f}
-• Fibonacci Level: {signal_data['fib_level']:.3f}
-• Confidence: {signal_data['confidence']:.1f}%
-
-🎯 <b>Targets:</b>
-• Take Profit: {signal_data['take_profit']:.5f}
-• Stop Loss: {signal_data['stop_loss']:.5f}
-
-⚠️ <b>Risk Management:</b>
-• Risk/Reward: 1:{signal_data['risk_reward']:.2f}
-• Suggested Position Size: {signal_data['position_size']:.2f}%
-
-<i>Generated at: {signal_data['timestamp']}</i>
-"""
-        return message
-        
-    def add_subscriber(self, chat_id: int):
+    async def add_subscriber(self, chat_id: int):
         """Add subscriber to signal notifications"""
         self.subscribers.add(chat_id)
-        logger.info(f"Added subscriber: {chat_id}")
+        logger.info("Added subscriber: %s", chat_id)
         
-    def remove_subscriber(self, chat_id: int):
+        if self._persist_subscribers:
+            async with self._subscriber_lock:
+                await asyncio.to_thread(self.storage.add_subscriber, chat_id)
+                
+    async def remove_subscriber(self, chat_id: int):
         """Remove subscriber from signal notifications"""
         self.subscribers.discard(chat_id)
-        logger.info(f"Removed subscriber: {chat_id}")
+        self._chat_limiters.pop(chat_id, None)
+        logger.info("Removed subscriber: %s", chat_id)
+        
+        if self._persist_subscribers:
+            async with self._subscriber_lock:
+                await asyncio.to_thread(self.storage.remove_subscriber, chat_id)